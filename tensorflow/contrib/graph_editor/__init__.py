@@ -117,6 +117,8 @@ which to operate must always be given explicitly. This is the reason why
 @@get_generating_ops
 @@get_consuming_ops
 @@ControlOutputs
+@@get_cached_control_outputs
+@@invalidate_cached_control_outputs
 @@placeholder_name
 @@make_placeholder_from_tensor
 @@make_placeholder_from_dtype_and_shape
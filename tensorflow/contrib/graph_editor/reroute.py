@@ -489,6 +489,7 @@ def remove_control_inputs(op, cops):
   op._control_inputs = [cop for cop in op._control_inputs if cop not in cops]
   op._recompute_node_def()
   # pylint: enable=protected-access
+  util.invalidate_cached_control_outputs(op.graph)
 
 
 def add_control_inputs(op, cops):
@@ -514,3 +515,4 @@ def add_control_inputs(op, cops):
   op._control_inputs += cops
   op._recompute_node_def()
   # pylint: enable=protected-access
+  util.invalidate_cached_control_outputs(op.graph)
@@ -421,6 +421,7 @@ def get_forward_walk_ops(seed_ops,
     return within_ops is None or op in within_ops
 
   result = list(seed_ops)
+  visited = set(seed_ops)
   wave = set(seed_ops)
   while wave:
     new_wave = set()
@@ -429,13 +430,14 @@ def get_forward_walk_ops(seed_ops,
         if new_t in stop_at_ts:
           continue
         for new_op in new_t.consumers():
-          if new_op not in result and is_within(new_op):
+          if new_op not in visited and is_within(new_op):
             new_wave.add(new_op)
       if control_outputs is not None:
         for new_op in control_outputs.get(op):
-          if new_op not in result and is_within(new_op):
+          if new_op not in visited and is_within(new_op):
             new_wave.add(new_op)
-    util.concatenate_unique(result, new_wave)
+    result.extend(new_wave)
+    visited.update(new_wave)
     wave = new_wave
   if not inclusive:
     result = [op for op in result if op not in seed_ops]
@@ -486,6 +488,7 @@ def get_backward_walk_ops(seed_ops,
     return within_ops is None or op in within_ops
 
   result = list(seed_ops)
+  visited = set(seed_ops)
   wave = set(seed_ops)
   while wave:
     new_wave = set()
@@ -493,13 +496,14 @@ def get_backward_walk_ops(seed_ops,
       for new_t in op.inputs:
         if new_t in stop_at_ts:
           continue
-        if new_t.op not in result and is_within(new_t.op):
+        if new_t.op not in visited and is_within(new_t.op):
           new_wave.add(new_t.op)
       if control_inputs:
         for new_op in op.control_inputs:
-          if new_op not in result and is_within(new_op):
+          if new_op not in visited and is_within(new_op):
             new_wave.add(new_op)
-    util.concatenate_unique(result, new_wave)
+    result.extend(new_wave)
+    visited.update(new_wave)
     wave = new_wave
   if not inclusive:
     result = [op for op in result if op not in seed_ops]
@@ -556,6 +560,7 @@ def get_walks_intersection_ops(forward_seed_ops,
       inclusive=backward_inclusive,
       within_ops=within_ops,
       control_inputs=control_inputs)
+  backward_ops = frozenset(backward_ops)
   return [op for op in forward_ops if op in backward_ops]
 
 
@@ -72,6 +72,60 @@ class TransformTest(tf.test.TestCase):
     new_assert_op = info.transformed(assert_op)
     self.assertIsNotNone(new_assert_op)
 
+  def test_copy_deep_graph(self):
+    graph = tf.Graph()
+    with graph.as_default():
+      t = tf.constant(1.0, name="Input")
+      for _ in range(1000):
+        t = tf.identity(t)
+    sgv, info = ge.copy(graph, tf.Graph())
+    self.assertEqual(len(sgv.ops), len(graph.get_operations()))
+    self.assertEqual(info.transformed(t).name, t.name)
+
+  def test_copy_many_dependencies(self):
+    graph = tf.Graph()
+    with graph.as_default():
+      ts = [tf.constant(float(i), name="Input") for i in range(200)]
+      cops = [tf.no_op(name="Control") for _ in range(200)]
+      with tf.control_dependencies(cops):
+        s = tf.add_n(ts + ts[::-1], name="Sum")
+    graph_ = tf.Graph()
+    _, info = ge.copy(graph, graph_)
+    s_ = info.transformed(s)
+    self.assertEqual([t.name for t in s_.op.inputs],
+                     [t.name for t in s.op.inputs])
+    self.assertEqual([op.name for op in s_.op.control_inputs],
+                     [op.name for op in s.op.control_inputs])
+    self.assertEqual(len(graph_.get_operations()),
+                     len(graph.get_operations()))
+
+
+    with self.graph.as_default():
+      tf.add_to_collection("my_collection", self.o)
+      tf.add_to_collection("my_collection", self.o.op)
+    graph = tf.Graph()
+    _, info = ge.copy(self.graph, graph, dst_scope="copy")
+    collection_ = graph.get_collection("copy/my_collection")
+    self.assertEqual(len(collection_), 2)
+    self.assertIn(info.transformed(self.o), collection_)
+    self.assertIn(info.transformed(self.o.op), collection_)
+
+  def test_copy_collections_unconsumed_output(self):
+    graph = tf.Graph()
+    with graph.as_default():
+      x = tf.constant([1, 2, 1], name="x")
+      y, idx = tf.unique(x)
+      tf.add_to_collection("my_collection", idx)
+    # idx is neither consumed nor an output of the subgraph view, but it is
+    # an output of a copied op: its copy belongs to the renamed collection.
+    sgv = ge.sgv(graph)
+    sgv = sgv.remap_outputs([sgv.output_index(y)])
+    self.assertNotIn(idx, sgv.outputs)
+    graph_ = tf.Graph()
+    _, info = ge.copy(sgv, graph_, dst_scope="copy")
+    self.assertEqual(graph_.get_collection("copy/my_collection"),
+                     [info.transformed(idx)])
+
   def test_transform(self):
     transformer = ge.Transformer()
     def my_transform_op_handler(info, op):
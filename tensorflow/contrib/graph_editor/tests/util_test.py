@@ -114,6 +114,20 @@ class UtilTest(tf.test.TestCase):
     self.assertEqual(len(control_outputs[x0.op]), 1)
     self.assertIs(list(control_outputs[x0.op])[0], c0.op)
 
+  def test_cached_control_outputs(self):
+    """Test for ge.util.get_cached_control_outputs."""
+    g0 = tf.Graph()
+    with g0.as_default():
+      a0 = tf.constant(1)
+      x0 = tf.constant(3)
+    control_outputs = ge.util.get_cached_control_outputs(g0)
+    self.assertIs(ge.util.get_cached_control_outputs(g0), control_outputs)
+    self.assertEqual(len(control_outputs.get_all()), 0)
+    ge.reroute.add_control_inputs(a0.op, [x0.op])
+    control_outputs = ge.util.get_cached_control_outputs(g0).get_all()
+    self.assertEqual(len(control_outputs), 1)
+    self.assertIs(list(control_outputs[x0.op])[0], a0.op)
+
   def test_scope(self):
     """Test simple path scope functionalities."""
     self.assertEqual(ge.util.scope_finalize("foo/bar"), "foo/bar/")
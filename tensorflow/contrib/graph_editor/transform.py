@@ -19,11 +19,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from copy import deepcopy
+import collections
 from functools import partial
 
-from six import iteritems
-from six import iterkeys
 from six import string_types
 from six import StringIO
 
@@ -48,6 +46,44 @@ __all__ = [
 ]
 
 
+def _clone_proto(proto):
+  """Return a copy of a protocol buffer message.
+
+  This is much faster than `copy.deepcopy`, which copies protocol buffers
+  through the generic (and slow) Python copy protocol.
+
+  Args:
+    proto: a protocol buffer message.
+  Returns:
+    A new message of the same type, equal to `proto`.
+  """
+  proto_ = type(proto)()
+  proto_.CopyFrom(proto)
+  return proto_
+
+
+def _get_transformed_t(transformed_ops, transformed_ts, t):
+  """Return the transformed tensor corresponding to the original one.
+
+  Only the tensors which are not generated by a transformed op (typically the
+  inputs of the subgraph) are recorded in `transformed_ts`, the other ones are
+  found through the transformed op generating them.
+
+  Args:
+    transformed_ops: dictionary mapping original ops to transformed ops.
+    transformed_ts: dictionary mapping original tensors to transformed tensors.
+    t: the original `tf.Tensor`.
+  Returns:
+    The transformed `tf.Tensor` or None if `t` has not been transformed.
+  """
+  op_ = transformed_ops.get(t.op)
+  if op_ is None:
+    return transformed_ts.get(t)
+  if t.value_index < len(op_.outputs):
+    return op_.outputs[t.value_index]
+  return None
+
+
 def replace_t_with_placeholder_handler(info, t):
   """Transform a tensor into a placeholder tensor.
 
@@ -93,10 +129,7 @@ def assign_renamed_collections_handler(info, elem, elem_):
     elem_: the transformed element
   """
   # TODO(fkp): handle known special cases
-  for name, collection in iteritems(
-      elem.graph._collections):  # pylint: disable=protected-access
-    if elem not in collection:
-      continue
+  for name in info.get_elem_to_collections().get(id(elem), ()):
     collection_name_ = info.transformer.new_name(name)
     info.graph_.add_to_collection(collection_name_, elem_)
 
@@ -117,7 +150,7 @@ def transform_op_if_inside_handler(info, op, keep_if_possible=True):
   """
   if op is None:
     return None
-  if op in info.sgv.ops:
+  if op in info.ops:
     return info.transformer._transform_op(  # pylint: disable=protected-access
         op)
   else:
@@ -149,23 +182,32 @@ def copy_op_handler(info, op, copy_shape=True):
                                                                 op._original_op)
 
   # Transform inputs:
-  inputs_ = [info.transformer._transform_t(t) for t in op.inputs]
+  inputs_ = [info.transformer._transform_t(t)
+             for t in info.get_original_inputs(op)]
 
   # Clone the node def:
-  node_def_ = deepcopy(op._node_def)
+  node_def_ = _clone_proto(op._node_def)
 
   # Transform name:
   name_ = info.transformer.new_name(op.name)
   name_ = info.graph_.unique_name(name_)
   node_def_.name = name_
 
-  # Copy the other inputs needed for initialization
-  output_types_ = op._output_types[:]
+  # Copy the other inputs needed for initialization. The output types are
+  # never modified after construction and can be shared, but the input types
+  # are updated in place when an input is added or rerouted.
+  output_types_ = op._output_types
   input_types_ = op._input_types[:]
 
   # Make a copy of the op_def too.
-  # Its unique to every _type_ of Operation.
-  op_def_ = deepcopy(op._op_def)
+  # Its unique to every _type_ of Operation, so it is only copied once per
+  # type and shared by the copied ops, as ops built from the registry do.
+  op_def_ = None
+  if op._op_def is not None:
+    op_def_ = info.op_defs_.get(op._op_def.name)
+    if op_def_ is None:
+      op_def_ = _clone_proto(op._op_def)
+      info.op_defs_[op._op_def.name] = op_def_
 
   # Initialize a new Operation instance
   op_ = tf_ops.Operation(node_def_, info.graph_, inputs_, output_types_,
@@ -199,10 +241,12 @@ def transform_op_in_place(info, op, detach_outputs=False):
   """
   # recursive call to the inputs:
   inputs = [info.transformer._transform_t(t)  # pylint: disable=protected-access
-            for t in op.inputs]
-  # re-connect to the inputs if they have changed:
-  if inputs != list(op.inputs):
-    reroute.reroute_a2b_ts(inputs, op.inputs)
+            for t in info.get_original_inputs(op)]
+  # re-connect to the inputs if they have changed. The inputs are read again
+  # since transforming them can modify them (e.g. detaching their outputs):
+  current_inputs = list(op.inputs)
+  if inputs != current_inputs:
+    reroute.reroute_a2b_ts(inputs, current_inputs)
   # detach op from its consumer first ?
   if detach_outputs:
     edit.detach_outputs(op)
@@ -226,18 +270,88 @@ class Transformer(object):
     argument to the handlers.
     """
 
+    __slots__ = ("transformer", "sgv", "sgv_inputs_set", "ops",
+                 "control_outputs", "graph", "scope", "graph_", "scope_",
+                 "transformed_ops", "transformed_ts", "device_functions",
+                 "record_op_seen_by_control_dependencies",
+                 "elem_to_collections", "skip_collections", "op_defs_",
+                 "original_inputs")
+
     def __init__(self, transformer, sgv, dst_graph, dst_scope, src_scope):
       self.transformer = transformer
       self.sgv = sgv
       self.sgv_inputs_set = frozenset(sgv.inputs)
       self.ops = frozenset(sgv.ops)
-      self.control_outputs = util.ControlOutputs(sgv.graph)
+      self.control_outputs = util.get_cached_control_outputs(sgv.graph)
       self.graph = sgv.graph
       self.scope = src_scope
       self.graph_ = dst_graph
       self.scope_ = dst_scope
       self.transformed_ops = {}
+      # Tensors generated by a transformed op are not recorded here, they are
+      # found through transformed_ops (see _get_transformed_t).
       self.transformed_ts = {}
+      # Inputs of the ops before transformation, see get_original_inputs.
+      self.original_inputs = {}
+      # Copies of the op_defs, by op type, shared by the copied ops.
+      self.op_defs_ = {}
+      # The device functions active in the destination graph, most recently
+      # pushed first, and the recorder of the active control dependencies.
+      # pylint: disable=protected-access
+      device_functions = []
+      for device_function in reversed(dst_graph._device_function_stack):
+        if device_function is None:
+          break
+        device_functions.append(device_function)
+      self.device_functions = tuple(device_functions)
+      self.record_op_seen_by_control_dependencies = (
+          dst_graph._record_op_seen_by_control_dependencies)
+      # pylint: enable=protected-access
+      # Built on first use, see get_elem_to_collections.
+      self.elem_to_collections = None
+      self.skip_collections = False
+
+    def get_elem_to_collections(self):
+      """Return the reverse index of the collections of the source graph.
+
+      The index is built on the first call only, so that transformers with a
+      custom collections handler do not pay for it.
+
+      Returns:
+        A dictionary mapping the id of an element to the names of the
+        collections it belongs to.
+      """
+      if self.elem_to_collections is None:
+        elem_to_collections = {}
+        # pylint: disable=protected-access
+        for name, collection in self.graph._collections.items():
+          for elem in collection:
+            names = elem_to_collections.setdefault(id(elem), [])
+            if not names or names[-1] != name:
+              names.append(name)
+        # pylint: enable=protected-access
+        self.elem_to_collections = elem_to_collections
+      return self.elem_to_collections
+
+    def get_original_inputs(self, op):
+      """Return the inputs of op as they were before being transformed.
+
+      The producers of an op are transformed before the op itself, and
+      transforming them can modify its inputs (for instance, an op transformed
+      in place with `detach_outputs=True` replaces the inputs of its consumers
+      with placeholders). The inputs are therefore recorded when the op is
+      first reached, and the handlers transform the recorded ones.
+
+      Args:
+        op: a `tf.Operation` of the subgraph.
+      Returns:
+        The list of the original input tensors of op.
+      """
+      inputs = self.original_inputs.get(op)
+      if inputs is None:
+        inputs = list(op.inputs)
+        self.original_inputs[op] = inputs
+      return inputs
 
   class ResultInfo(object):
     """"Contains information about the result of a transform operation."""
@@ -255,6 +369,9 @@ class Transformer(object):
       self._scope_ = info.scope_
       self._transformed_ops = info.transformed_ops
       self._transformed_ts = info.transformed_ts
+      # Reverse mappings, built on demand by _get_original_map.
+      self._original_ops = None
+      self._original_ts = None
 
     def _get_transformed_map(self, top):
       """Return the correct container depending on the type of `top`."""
@@ -267,6 +384,57 @@ class Transformer(object):
             "Expected a tf.Tensor or a tf.Operation, got a {}".format(
                 type(top)))
 
+    def _get_original_map(self, top):
+      """Return the reverse of the container given by _get_transformed_map.
+
+      The reverse mapping is a tuple `(by_elem, by_name)` of dictionaries
+      mapping a transformed element, respectively its name, to the original
+      element. If several elements are transformed into the same one, the
+      first of them is kept.
+
+      Args:
+        top: a `tf.Tensor` or a `tf.Operation`.
+      Returns:
+        A tuple of two dictionaries.
+      Raises:
+        TypeError: if `top` is not a `tf.Tensor` or a `tf.Operation`.
+      """
+      transformed_map = self._get_transformed_map(top)
+      if transformed_map is self._transformed_ops:
+        if self._original_ops is None:
+          self._original_ops = self._reverse_map(
+              self._get_transformed_items(transformed_map))
+        return self._original_ops
+      else:
+        if self._original_ts is None:
+          self._original_ts = self._reverse_map(
+              self._get_transformed_items(transformed_map))
+        return self._original_ts
+
+    def _get_transformed_items(self, transformed_map):
+      """Return the list of `(original, transformed)` pairs of the container.
+
+      The tensors generated by the transformed ops, which are not recorded
+      in the tensor container, are included.
+      """
+      items = list(transformed_map.items())
+      if transformed_map is self._transformed_ts:
+        for op, op_ in self._transformed_ops.items():
+          items.extend(zip(op.outputs, op_.outputs))
+      return items
+
+    @staticmethod
+    def _reverse_map(items):
+      """Build the `(by_elem, by_name)` reverse of `(original, transformed)`."""
+      by_elem = {}
+      by_name = {}
+      for original, transformed in items:
+        if transformed not in by_elem:
+          by_elem[transformed] = original
+        if transformed.name not in by_name:
+          by_name[transformed.name] = original
+      return by_elem, by_name
+
     def _transformed_elem(self, original_top, missing_fn=None):
       """Return the transformed op/tensor corresponding to the original one.
 
@@ -279,14 +447,20 @@ class Transformer(object):
       """
       transformed_map = self._get_transformed_map(original_top)
       if isinstance(original_top, string_types):
-        for original, transformed in iteritems(transformed_map):
+        for original, transformed in self._get_transformed_items(
+            transformed_map):
           if original.name == original_top:
             return transformed
         return None if missing_fn is None else missing_fn(original_top)
       else:
-        if original_top not in transformed_map:
+        if transformed_map is self._transformed_ts:
+          transformed = _get_transformed_t(self._transformed_ops,
+                                           transformed_map, original_top)
+        else:
+          transformed = transformed_map.get(original_top)
+        if transformed is None:
           return None if missing_fn is None else missing_fn(original_top)
-        return transformed_map[original_top]
+        return transformed
 
     def _original_elem(self, transformed_top, missing_fn=None):
       """Return the original op/tensor corresponding to the transformed one.
@@ -298,15 +472,14 @@ class Transformer(object):
       Returns:
         the original tensor/operation (or None if no match is found).
       """
-      transformed_map = self._get_transformed_map(transformed_top)
+      by_elem, by_name = self._get_original_map(transformed_top)
       if isinstance(transformed_top, string_types):
-        finder = lambda transformed: transformed.name == transformed_top
+        original_map = by_name
       else:
-        finder = lambda transformed: transformed == transformed_top
-      for original, transformed in iteritems(transformed_map):
-        if finder(transformed):
-          return original
-      return None if missing_fn is None else missing_fn(transformed_top)
+        original_map = by_elem
+      if transformed_top not in original_map:
+        return None if missing_fn is None else missing_fn(transformed_top)
+      return original_map[transformed_top]
 
     def transformed(self, original, missing_fn=None):
       """Return the transformed op/tensor corresponding to the original one.
@@ -324,7 +497,7 @@ class Transformer(object):
         the transformed tensor/operation (or None if no match is found).
       """
       transformed_elem = partial(self._transformed_elem, missing_fn=missing_fn)
-      return util.transform_tree(original, transformed_elem)
+      return self._map_tops(original, transformed_elem)
 
     def original(self, transformed, missing_fn=None):
       """Return the original op/tensor corresponding to the transformed one.
@@ -342,7 +515,28 @@ class Transformer(object):
         the original tensor/operation (or None if no match is found).
       """
       original_elem = partial(self._original_elem, missing_fn=missing_fn)
-      return util.transform_tree(transformed, original_elem)
+      return self._map_tops(transformed, original_elem)
+
+    @staticmethod
+    def _map_tops(tops, fn):
+      """Apply `fn` to all the tensors/operations of the tree `tops`.
+
+      Single elements and flat lists or tuples, the common cases, are handled
+      directly; other trees go through `util.transform_tree`.
+
+      Args:
+        tops: a tensor/operation or a tree of tensors/operations.
+        fn: function to apply to each tensor/operation.
+      Returns:
+        A tree mimicking the hierarchy of `tops`.
+      """
+      top_types = (tf_ops.Tensor, tf_ops.Operation)
+      if isinstance(tops, top_types):
+        return fn(tops)
+      if type(tops) in (list, tuple) and all(
+          isinstance(top, top_types) for top in tops):
+        return type(tops)(fn(top) for top in tops)
+      return util.transform_tree(tops, fn)
 
     def __str__(self):
       res = StringIO()
@@ -359,7 +553,7 @@ class Transformer(object):
       if self._scope_:
         print("  Scope destination: {}".format(self._scope_), file=res)
       print("Operations mapping:", file=res)
-      for op, op_ in iteritems(self._transformed_ops):
+      for op, op_ in self._transformed_ops.items():
         print("  {} => {}".format(op.name, op_.name), file=res)
       return res.getvalue()
 
@@ -393,8 +587,9 @@ class Transformer(object):
     self.transform_external_hidden_input_handler = keep_t_if_possible_handler
     self.transform_original_op_handler = transform_op_if_inside_handler
 
-    # temporary per-call variable
+    # temporary per-call variables
     self._info = None
+    self._scope_len = 0
 
   def __call__(self,
                sgv,
@@ -437,18 +632,25 @@ class Transformer(object):
 
     # Create temporary info used during this transform call
     self._info = Transformer._Info(self, sgv, dst_graph, dst_scope, src_scope)
-
-    # Transform the graph starting from the output tensors.
-    for output_t in self._info.sgv.outputs:
-      self._transform_t(output_t)
-
-    # Some ops might have been missed by the previous walk, namely, the roots
-    # without any outputs. So the walk is now finalized from those roots.
-    remaining_ops = [op for op in self._info.sgv.ops
-                     if op not in self._info.transformed_ops]
-    remaining_roots = [op for op in remaining_ops if not op.outputs]
-    for op in remaining_roots:
-      self._transform_op(op)
+    self._scope_len = len(src_scope)
+
+    # The default collections handler has nothing to do if no element of the
+    # source graph belongs to a collection. Note that it is not a no-op when
+    # copying within the same graph and scope: the copies are added to the
+    # collections of the originals.
+    self._info.skip_collections = (
+        self.assign_collections_handler is assign_renamed_collections_handler
+        and not self._info.get_elem_to_collections())
+
+    # Transform the ops reachable from the output tensors and from the roots
+    # without any outputs, producers first, so that the inputs of an op are
+    # already transformed when its handler is called.
+    transformed_ops = self._info.transformed_ops
+    for op in self._topological_order():
+      if op not in transformed_ops:
+        self._call_transform_op_handler(op)
+    # Finalize with the outputs which are not generated inside the subgraph.
+    self._transform_tops(self._info.sgv.outputs)
 
     sgv_ = self._transform_sgv(sgv)
 
@@ -456,6 +658,66 @@ class Transformer(object):
     self._info = None
     return sgv_, res_info
 
+  def _topological_order(self):
+    """Return the ops of the subgraph to be transformed, sorted.
+
+    The ops are collected with a breadth-first walk going backward from the
+    outputs and from the roots without any outputs (which the walk would
+    miss otherwise). They are then sorted breadth-first (Kahn's algorithm)
+    so that every op comes after the ops producing its inputs and its control
+    inputs. Ops which cannot be sorted because of a cycle are appended last.
+
+    The inputs of all the ops are recorded (see `_Info.get_original_inputs`)
+    before any of them is transformed.
+
+    Returns:
+      A list of `tf.Operation`, producers first.
+    """
+    ops = self._info.ops
+    reachable = []
+    seen = set()
+    seeds = [t.op for t in self._info.sgv.outputs]
+    seeds += [op for op in self._info.sgv.ops if not op.outputs]
+    for op in seeds:
+      if op in ops and op not in seen:
+        seen.add(op)
+        reachable.append(op)
+    in_degree = {}
+    consumers = {}
+    i = 0
+    while i < len(reachable):
+      op = reachable[i]
+      i += 1
+      deps = []
+      deps_set = set()
+      for t in self._info.get_original_inputs(op):
+        if t.op in ops and t.op not in deps_set:
+          deps_set.add(t.op)
+          deps.append(t.op)
+      for dep in op.control_inputs:
+        if dep in ops and dep not in deps_set:
+          deps_set.add(dep)
+          deps.append(dep)
+      in_degree[op] = len(deps)
+      for dep in deps:
+        if dep not in seen:
+          seen.add(dep)
+          reachable.append(dep)
+        consumers.setdefault(dep, []).append(op)
+
+    order = []
+    ready = collections.deque(op for op in reachable if not in_degree[op])
+    while ready:
+      op = ready.popleft()
+      order.append(op)
+      for consumer in consumers.get(op, ()):
+        in_degree[consumer] -= 1
+        if not in_degree[consumer]:
+          ready.append(consumer)
+    if len(order) < len(reachable):
+      order += [op for op in reachable if in_degree[op]]
+    return order
+
   def _transform_sgv(self, sgv):
     """Transform a subgraph view.
 
@@ -467,32 +729,35 @@ class Transformer(object):
     Returns:
       The transformed subgraph.
     """
-    ops_ = [op_ for _, op_ in iteritems(self._info.transformed_ops)]
+    ops_ = list(self._info.transformed_ops.values())
     sgv_ = subgraph.SubGraphView(ops_)
-    sgv_inputs_ = sgv_.inputs
-    sgv_outputs_ = sgv_.outputs
+    transformed_ops = self._info.transformed_ops
+    transformed_ts = self._info.transformed_ts
+
+    # Index the inputs and outputs of sgv_ (first occurrence wins, like
+    # sgv_.input_index and sgv_.output_index).
+    input_indices_ = {}
+    for i, input_t_ in enumerate(sgv_.inputs):
+      input_indices_.setdefault(input_t_, i)
+    output_indices_ = {}
+    for i, output_t_ in enumerate(sgv_.outputs):
+      output_indices_.setdefault(output_t_, i)
 
     # re-order inputs
     input_map_ = []
     for input_t in sgv.inputs:
-      if input_t not in self._info.transformed_ts:
-        continue
-      input_t_ = self._info.transformed_ts[input_t]
-      if input_t_ not in sgv_inputs_:
+      input_t_ = _get_transformed_t(transformed_ops, transformed_ts, input_t)
+      if input_t_ not in input_indices_:
         continue
-      input_t_index_ = sgv_.input_index(input_t_)
-      input_map_.append(input_t_index_)
+      input_map_.append(input_indices_[input_t_])
 
     # re-order outputs
     output_map_ = []
     for output_t in sgv.outputs:
-      if output_t not in self._info.transformed_ts:
-        continue
-      output_t_ = self._info.transformed_ts[output_t]
-      if output_t_ not in sgv_outputs_:
+      output_t_ = _get_transformed_t(transformed_ops, transformed_ts, output_t)
+      if output_t_ not in output_indices_:
         continue
-      output_t_index_ = sgv_.output_index(output_t_)
-      output_map_.append(output_t_index_)
+      output_map_.append(output_indices_[output_t_])
 
     return sgv_.remap(input_map_, output_map_)
 
@@ -504,64 +769,144 @@ class Transformer(object):
     Returns:
       The transformed tensor.
     """
-    if t in self._info.transformed_ts:
-      return self._info.transformed_ts[t]
+    info = self._info
+    op = t.op
+    if op not in info.ops:
+      t_ = info.transformed_ts.get(t)
+      if t_ is None:
+        t_ = self._call_transform_t_handler(t)
+      return t_
+    op_ = info.transformed_ops.get(op)
+    if op_ is None:
+      self._transform_tops([op])
+      op_ = info.transformed_ops[op]
+    return op_.outputs[t.value_index]
 
-    op, op_index = t.op, t.value_index
+  def _transform_op(self, op):
+    """Transform a tf.Operation.
 
-    # If op is not in the subgraph:
-    if op not in self._info.ops:
-      # t_ is an input of the subgraph
-      if t in self._info.sgv_inputs_set:
-        t_ = self.transform_external_input_handler(self._info, t)
-      # t_ is a hidden input of the subgraph
+    Args:
+      op: the operation to be transformed.
+    Returns:
+      The transformed operation.
+    """
+    transformed_ops = self._info.transformed_ops
+    if op not in transformed_ops:
+      self._transform_tops([op])
+    return transformed_ops[op]
+
+  def _transform_tops(self, tops):
+    """Transform tensors and operations with an iterative depth-first walk.
+
+    An operation is only handed to the transform handler once its input
+    tensors and its control inputs within the subgraph have been transformed,
+    so that the handlers find them already transformed. Using an explicit
+    stack avoids hitting the Python recursion limit on deep graphs.
+
+    Args:
+      tops: an iterable of `tf.Tensor` and/or `tf.Operation` to transform.
+    """
+    info = self._info
+    ops = info.ops
+    transformed_ops = info.transformed_ops
+    transformed_ts = info.transformed_ts
+    stack = list(tops)
+    stack.reverse()
+    expanded = set()
+    while stack:
+      top = stack.pop()
+      if isinstance(top, tf_ops.Operation):
+        op = top
+        if op in transformed_ops:
+          continue
+
+        # Transform the dependencies first (in the order used by the handlers).
+        if op not in expanded:
+          expanded.add(op)
+          deps = [ci for ci in op.control_inputs
+                  if ci in ops and ci not in transformed_ops]
+          deps += [t for t in info.get_original_inputs(op)
+                   if t.op not in transformed_ops and t not in transformed_ts]
+          if deps:
+            stack.append(op)
+            stack.extend(reversed(deps))
+            continue
+
+        self._call_transform_op_handler(op)
       else:
-        t_ = self.transform_external_hidden_input_handler(self._info, t)
-    # If op is in the subgraph, just transform it:
-    else:
-      op_ = self._transform_op(op)
-      t_ = op_.outputs[op_index]
+        t = top
+        op = t.op
 
-    # assign to collection
-    if t is not t_:
-      self.assign_collections_handler(self._info, t, t_)
+        # If op is in the subgraph, t is transformed along with it:
+        if op in ops:
+          if op not in transformed_ops:
+            stack.append(op)
+          continue
 
-    self._info.transformed_ts[t] = t_
-    return t_
+        if t not in transformed_ts:
+          self._call_transform_t_handler(t)
 
-  def _transform_op(self, op):
-    """Transform a tf.Operation.
+  def _call_transform_op_handler(self, op):
+    """Transform an op of the subgraph with the transform handler.
 
     Args:
-      op: the operation to be transformed.
+      op: the `tf.Operation` to be transformed, which must not have been
+        transformed yet.
     Returns:
       The transformed operation.
     """
-    if op in self._info.transformed_ops:
-      return self._info.transformed_ops[op]
-
-    op_ = self.transform_op_handler(self._info, op)
+    info = self._info
+    op_ = self.transform_op_handler(info, op)
 
     # Add to all the active control dependencies
-    # pylint: disable=protected-access
-    self._info.graph_._record_op_seen_by_control_dependencies(op_)
+    info.record_op_seen_by_control_dependencies(op_)
 
     # All to all the active devices
-    for device_function in reversed(self._info.graph_._device_function_stack):
-      if device_function is None:
-        break
-      op_._set_device(device_function(op_))
+    # pylint: disable=protected-access
+    if info.device_functions:
+      for device_function in info.device_functions:
+        op_._set_device(device_function(op_))
     # pylint: enable=protected-access
 
-    # TODO(fkp): Establish clear policy about what context managers are allowed.
+    # TODO(fkp): Establish clear policy about what context managers are
+    # allowed.
 
-    # assign to collection
-    if op is not op_:
-      self.assign_collections_handler(self._info, op, op_)
+    # assign to collection (the op and its output tensors)
+    if not info.skip_collections:
+      if op is not op_:
+        self.assign_collections_handler(info, op, op_)
+      for t, t_ in zip(op.outputs, op_.outputs):
+        if t is not t_:
+          self.assign_collections_handler(info, t, t_)
 
-    self._info.transformed_ops[op] = op_
+    info.transformed_ops[op] = op_
     return op_
 
+  def _call_transform_t_handler(self, t):
+    """Transform a tensor generated outside of the subgraph.
+
+    Args:
+      t: the `tf.Tensor` to be transformed, which must not have been
+        transformed yet.
+    Returns:
+      The transformed tensor.
+    """
+    info = self._info
+
+    # t_ is an input of the subgraph
+    if t in info.sgv_inputs_set:
+      t_ = self.transform_external_input_handler(info, t)
+    # t_ is a hidden input of the subgraph
+    else:
+      t_ = self.transform_external_hidden_input_handler(info, t)
+
+    # assign to collection
+    if t is not t_ and not info.skip_collections:
+      self.assign_collections_handler(info, t, t_)
+
+    info.transformed_ts[t] = t_
+    return t_
+
   def new_name(self, name):
     """Compute a destination name from a source name.
 
@@ -577,7 +922,7 @@ class Transformer(object):
     if not name.startswith(scope):
       raise ValueError("{} does not belong to source scope: {}.".format(name,
                                                                         scope))
-    rel_name = name[len(scope):]
+    rel_name = name[self._scope_len:]
     name_ = self._info.scope_ + rel_name
     return name_
 
@@ -693,8 +1038,8 @@ def graph_replace(target_ts, replacement_ts, dst_scope="",
   # the get_walks_intersection_ops can also traverse the
   # control dependencies.
   graph = util.get_unique_graph(flatten_target_ts, check_types=(tf_ops.Tensor))
-  control_ios = util.ControlOutputs(graph)
-  ops = select.get_walks_intersection_ops(list(iterkeys(replacement_ts)),
+  control_ios = util.get_cached_control_outputs(graph)
+  ops = select.get_walks_intersection_ops(list(replacement_ts),
                                           flatten_target_ts,
                                           control_ios=control_ios)
   if not ops:
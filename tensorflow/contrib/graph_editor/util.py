@@ -31,6 +31,8 @@ __all__ = [
     "get_generating_ops",
     "get_consuming_ops",
     "ControlOutputs",
+    "get_cached_control_outputs",
+    "invalidate_cached_control_outputs",
     "placeholder_name",
     "make_placeholder_from_tensor",
     "make_placeholder_from_dtype_and_shape",
@@ -371,6 +373,53 @@ class ControlOutputs(object):
     return self._graph
 
 
+def get_cached_control_outputs(graph):
+  """Return the control outputs of a graph, reusing them across calls.
+
+  The `ControlOutputs` instance is stored on the graph itself so that its
+  lifetime is the one of the graph. It is rebuilt only if the graph has
+  changed since the last call (see `ControlOutputs.update`).
+
+  Note that a change is only detected through the version of the graph,
+  which is bumped when an op is added, and through the functions
+  `reroute.add_control_inputs` and `reroute.remove_control_inputs`. Control
+  inputs modified by other means on existing ops (for instance with
+  `tf.Operation._add_control_input`, as the control flow code does) are not
+  detected: call `invalidate_cached_control_outputs` after such changes, or
+  build a fresh `ControlOutputs` instance instead.
+
+  Args:
+    graph: a `tf.Graph`.
+  Returns:
+    An up-to-date `ControlOutputs` instance for `graph`.
+  Raises:
+    TypeError: graph is not a `tf.Graph`.
+  """
+  if not isinstance(graph, tf_ops.Graph):
+    raise TypeError("Expected a tf.Graph, got: {}".format(type(graph)))
+  # pylint: disable=protected-access
+  control_outputs = getattr(graph, "_graph_editor_control_outputs", None)
+  if control_outputs is None:
+    control_outputs = ControlOutputs(graph)
+    graph._graph_editor_control_outputs = control_outputs
+  # pylint: enable=protected-access
+  return control_outputs.update()
+
+
+def invalidate_cached_control_outputs(graph):
+  """Force the cached control outputs of a graph to be rebuilt.
+
+  This must be called when control inputs are modified in place, since such
+  modifications do not change the version of the graph.
+
+  Args:
+    graph: a `tf.Graph`.
+  """
+  control_outputs = getattr(graph, "_graph_editor_control_outputs", None)
+  if control_outputs is not None:
+    control_outputs._version = None  # pylint: disable=protected-access
+
+
 def scope_finalize(scope):
   if scope and scope[-1] != "/":
     scope += "/"